@@ -1,11 +1,44 @@
 import os
-import json
+import re
 import time
+import random
 import hashlib
+import mmap
+import contextlib
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
 from typing import Dict, List, Tuple, Optional
 import math
 
+# 32位十六进制的MD5摘要
+MD5_HEX_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+def positive_int_setting(config: dict, key: str, default: int) -> int:
+    """读取必须为正整数的配置项，未配置或为null时使用默认值"""
+    value = config.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise Exception(f"配置项 {key} 必须是正整数: {value}")
+    return value
+
+
+def create_session(pool_size: int = 32) -> requests.Session:
+    """创建复用TCP/TLS连接、并对服务端临时错误自动重试的会话，每个主机最多保持pool_size个连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 class Pan123Uploader:
     def __init__(self, config_path='config.json'):
         self.base_url = 'https://open-api.123pan.com'
@@ -15,27 +48,35 @@ class Pan123Uploader:
             'Authorization': f"Bearer {self.config['access_token']}",
             'Content-Type': 'application/json'
         }
+        self.upload_concurrency = positive_int_setting(self.config, 'upload_concurrency', 8)
+        self.hash_workers = positive_int_setting(self.config, 'hash_workers', os.cpu_count() or 1)
+        # 连接池需容纳所有并发上传线程，否则多出的连接会被丢弃
+        self.session = create_session(pool_size=self.upload_concurrency)
+        self._upload_url_request = None
 
     def load_config(self, config_path: str) -> dict:
         """加载配置文件"""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(config_path, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception as e:
             raise Exception(f"读取配置文件失败: {str(e)}")
 
-    def calculate_file_md5(self, file_path: str) -> str:
-        """计算文件MD5"""
-        md5_hash = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
-
     def calculate_chunk_md5(self, chunk: bytes) -> str:
         """计算分片MD5"""
         return hashlib.md5(chunk).hexdigest()
 
+    def advise_sequential(self, fd: int):
+        """提示内核将顺序读取该文件，以扩大预读窗口（无posix_fadvise的平台直接跳过）"""
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def map_file(self, f):
+        """以只读方式将文件映射到内存（空文件无法mmap，直接使用空bytes）"""
+        if os.fstat(f.fileno()).st_size == 0:
+            return contextlib.nullcontext(b'')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     def create_directory(self, name: str, parent_id: int = 0) -> int:
         """创建目录"""
         url = f"{self.base_url}/upload/v1/file/mkdir"
@@ -44,18 +85,15 @@ class Pan123Uploader:
             "parentID": parent_id
         }
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['dirID']
         raise Exception(f"创建目录失败: {data['message']}")
 
-    def create_file(self, filename: str, file_path: str, parent_id: int = 0) -> Tuple[str, int, bool, int]:
+    def create_file(self, filename: str, file_size: int, file_md5: str, parent_id: int = 0) -> Tuple[str, int, bool, int]:
         """创建文件，返回预上传ID、文件ID、是否秒传、分片大小"""
-        file_size = os.path.getsize(file_path)
-        file_md5 = self.calculate_file_md5(file_path)
-        
         url = f"{self.base_url}/upload/v1/file/create"
         payload = {
             "parentFileID": parent_id,
@@ -64,8 +102,8 @@ class Pan123Uploader:
             "size": file_size
         }
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return (
@@ -78,14 +116,23 @@ class Pan123Uploader:
 
     def get_upload_url(self, preupload_id: str, slice_no: int) -> str:
         """获取上传地址"""
-        url = f"{self.base_url}/upload/v1/file/get_upload_url"
         payload = {
             "preuploadID": preupload_id,
             "sliceNo": slice_no
         }
-        
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+
+        # 每个分片都会调用，复用预先构造好的请求，只需填充请求体
+        if self._upload_url_request is None:
+            url = f"{self.base_url}/upload/v1/file/get_upload_url"
+            prepared = self.session.prepare_request(requests.Request('POST', url, headers=self.headers))
+            settings = self.session.merge_environment_settings(url, {}, None, None, None)
+            self._upload_url_request = (prepared, settings)
+        prepared, settings = self._upload_url_request
+        request = prepared.copy()
+        request.prepare_body(data=orjson.dumps(payload), files=None)
+
+        response = self.session.send(request, **settings)
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['presignedURL']
@@ -96,8 +143,8 @@ class Pan123Uploader:
         url = f"{self.base_url}/upload/v1/file/list_upload_parts"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['parts']
@@ -108,8 +155,8 @@ class Pan123Uploader:
         url = f"{self.base_url}/upload/v1/file/upload_complete"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return (
@@ -124,63 +171,131 @@ class Pan123Uploader:
         url = f"{self.base_url}/upload/v1/file/upload_async_result"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['completed'], data['data']['fileID']
         raise Exception(f"检查异步结果失败: {data['message']}")
 
+    def upload_chunk(self, preupload_id: str, slice_no: int, chunk: memoryview, url_future: Future, etag_future: Future) -> Dict:
+        """上传单个分片（内存映射的零拷贝视图，上传后立即释放），返回分片号及其MD5"""
+        with chunk:
+            # 上传地址已提前请求，通常此时已经就绪
+            upload_url = url_future.result()
+
+            # 上传分片
+            response = self.session.put(upload_url, data=chunk)
+
+            if response.status_code != 200:
+                raise Exception(f"分片 {slice_no} 上传失败: {response.text}")
+
+            # 对象存储返回的ETag通常即分片内容的MD5，可直接在本地校验；
+            # 不是MD5格式的ETag（如加密存储或厂商自定义格式）则留给list_uploaded_parts校验
+            etag = etag_future.result()
+            server_etag = response.headers.get('ETag', '').strip('"').lower()
+            verified = MD5_HEX_PATTERN.fullmatch(server_etag) is not None
+            if verified and server_etag != etag:
+                raise Exception(f"分片 {slice_no} 验证失败")
+
+            return {
+                'partNumber': slice_no,
+                'etag': etag,
+                'verified': verified
+            }
+
+    def upload_slices(self, preupload_id: str, buf, slice_size: int) -> List[Dict]:
+        """从内存映射中切分并并发上传所有分片，返回各分片的分片号、MD5及是否已在本地校验"""
+        total_chunks = math.ceil(len(buf) / slice_size)
+        concurrency = self.upload_concurrency
+        uploaded_chunks = []
+
+        # 读取、哈希、上传三个阶段流水线并行：主线程按顺序切分分片，
+        # 哈希线程池计算分片MD5（hashlib计算时释放GIL，可占用多个CPU核心），
+        # 上传线程池PUT分片，各阶段互相掩盖耗时。
+        # 上传地址在分片进入流水线时即开始请求，等轮到上传时往返已经完成
+        with memoryview(buf) as view, \
+                ThreadPoolExecutor(max_workers=self.hash_workers) as hasher, \
+                ThreadPoolExecutor(max_workers=concurrency) as url_fetcher, \
+                ThreadPoolExecutor(max_workers=concurrency) as uploader:
+            # 循环中频繁使用的方法预先绑定为局部变量
+            get_upload_url = self.get_upload_url
+            calculate_chunk_md5 = self.calculate_chunk_md5
+            upload_chunk = self.upload_chunk
+            submit_url, submit_hash, submit_upload = url_fetcher.submit, hasher.submit, uploader.submit
+
+            # 分片完成后统一在主线程记录结果并输出进度，避免多个上传线程同时打印
+            def collect(done):
+                for future in done:
+                    part = future.result()
+                    uploaded_chunks.append(part)
+                    print(f"已上传分片 {part['partNumber']}/{total_chunks}")
+
+            pending = set()
+            try:
+                for chunk_index in range(total_chunks):
+                    offset = chunk_index * slice_size
+                    slice_no = chunk_index + 1
+
+                    # 直接传递内存映射的切片视图，避免为每个分片复制一份bytes
+                    url_future = submit_url(get_upload_url, preupload_id, slice_no)
+                    etag_future = submit_hash(calculate_chunk_md5, view[offset:offset + slice_size])
+                    pending.add(submit_upload(
+                        upload_chunk, preupload_id, slice_no,
+                        view[offset:offset + slice_size], url_future, etag_future
+                    ))
+
+                    # 限制流水线中同时驻留内存的分片数量
+                    if len(pending) >= concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            except Exception:
+                # 任一分片失败则取消尚未开始的分片
+                for future in pending:
+                    future.cancel()
+                raise
+
+        return uploaded_chunks
+
     def upload_file(self, file_path: str, parent_id: int = 0) -> int:
         """上传文件的主函数"""
         filename = os.path.basename(file_path)
         print(f"开始上传文件: {filename}")
 
-        # 1. 创建文件
-        preupload_id, file_id, is_reuse, slice_size = self.create_file(filename, file_path, parent_id)
-        
-        if is_reuse:
-            print("文件秒传成功！")
-            return file_id
+        with open(file_path, 'rb', buffering=0) as f, self.map_file(f) as buf:
+            file_size = len(buf)
+            self.advise_sequential(f.fileno())
 
-        print(f"文件需要分片上传，分片大小: {slice_size} bytes")
-        
-        # 2. 分片上传
-        file_size = os.path.getsize(file_path)
-        total_chunks = math.ceil(file_size / slice_size)
-        uploaded_chunks = []
+            # 1. 创建文件（MD5与分片上传共用同一份内存映射）
+            # 文件能放进页缓存时，分片上传直接命中缓存，磁盘只读一次；
+            # 文件大于可用内存时，计算MD5读过的页会被回收，上传分片时仍需再从磁盘读一遍
+            file_md5 = hashlib.md5(buf).hexdigest()
+            preupload_id, file_id, is_reuse, slice_size = self.create_file(filename, file_size, file_md5, parent_id)
+
+            if is_reuse:
+                print("文件秒传成功！")
+                return file_id
+
+            print(f"文件需要分片上传，分片大小: {slice_size} bytes")
 
-        with open(file_path, 'rb') as f:
-            for chunk_index in range(total_chunks):
-                chunk = f.read(slice_size)
-                slice_no = chunk_index + 1
-                
-                # 获取上传URL
-                upload_url = self.get_upload_url(preupload_id, slice_no)
-                
-                # 上传分片
-                print(f"上传分片 {slice_no}/{total_chunks}")
-                response = requests.put(upload_url, data=chunk)
-                
-                if response.status_code != 200:
-                    raise Exception(f"分片 {slice_no} 上传失败: {response.text}")
-                
-                uploaded_chunks.append({
-                    'partNumber': slice_no,
-                    'etag': self.calculate_chunk_md5(chunk)
-                })
+            # 2. 分片上传（多个分片并发上传）
+            uploaded_chunks = self.upload_slices(preupload_id, buf, slice_size)
 
         # 3. 验证分片（如果文件大于分片大小）
-        if file_size > slice_size:
+        # 上传时已用响应ETag校验过的分片无需再向服务端列举，除非配置了strict_verify
+        verified_locally = all(part['verified'] for part in uploaded_chunks)
+        if file_size > slice_size and (self.config.get('strict_verify') or not verified_locally):
             print("验证已上传分片...")
             server_parts = self.list_uploaded_parts(preupload_id)
+            server_parts_by_number = {p['partNumber']: p for p in server_parts}
             
             # 验证每个分片
             for local_part in uploaded_chunks:
-                server_part = next(
-                    (p for p in server_parts if p['partNumber'] == local_part['partNumber']),
-                    None
-                )
+                server_part = server_parts_by_number.get(local_part['partNumber'])
                 if not server_part or server_part['etag'] != local_part['etag']:
                     raise Exception(f"分片 {local_part['partNumber']} 验证失败")
 
@@ -191,12 +306,15 @@ class Pan123Uploader:
         # 5. 如果需要，等待异步结果
         if is_async:
             print("等待服务器处理...")
+            # 指数退避轮询（带少量随机抖动），上限30秒
+            delay = 0.5
             while True:
                 completed, final_file_id = self.check_async_result(preupload_id)
                 if completed:
                     file_id = final_file_id
                     break
-                time.sleep(1)
+                time.sleep(delay + random.uniform(0, delay * 0.1))
+                delay = min(delay * 1.7, 30.0)
 
         print(f"文件上传成功！文件ID: {file_id}")
         return file_id
@@ -1,32 +1,96 @@
 import os
-import json
+import re
 import time
+import random
 import hashlib
+import mmap
+import contextlib
+import orjson
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
 import urllib.parse
 import math
 import sys
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime, timezone
 
+# 32位十六进制的MD5摘要
+MD5_HEX_PATTERN = re.compile(r'[0-9a-f]{32}')
+# 文件列表接口单页最多返回100条
+LIST_PAGE_LIMIT = 100
+# 下载时每次写入磁盘的块大小
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 超过该大小且服务端支持Range时分段并发下载
+PARALLEL_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+
+
+def positive_int_setting(config: dict, key: str, default: int) -> int:
+    """读取必须为正整数的配置项，未配置或为null时使用默认值"""
+    value = config.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise Exception(f"配置项 {key} 必须是正整数: {value}")
+    return value
+
+
+def create_session(pool_size: int = 32) -> requests.Session:
+    """创建复用TCP/TLS连接、并对服务端临时错误自动重试的会话，每个主机最多保持pool_size个连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# 已解析的配置，按路径缓存，TokenManager与Pan123FileManager共享同一份
+_config_cache: Dict[str, dict] = {}
+# 内存中有尚未写入文件的修改的配置路径
+_dirty_configs = set()
+
+
+def read_config_file(config_path: str) -> dict:
+    """读取配置文件，同一路径只解析一次"""
+    if config_path not in _config_cache:
+        try:
+            with open(config_path, 'rb') as f:
+                _config_cache[config_path] = orjson.loads(f.read())
+        except Exception as e:
+            raise Exception(f"读取配置文件失败: {str(e)}")
+    return _config_cache[config_path]
+
+
+def write_config_file(config_path: str, config: dict):
+    """先写临时文件再原子替换，避免写入中断损坏配置文件"""
+    tmp_path = f"{config_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        # 确保内容落盘后再替换，否则崩溃后可能留下空的配置文件
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, config_path)
+    # 写入的是共享的整份配置，之前未保存的修改也已一并写入
+    _dirty_configs.discard(config_path)
+
 
 class TokenManager:
     def __init__(self, config_path='config.json'):
         self.config_path = config_path
         self.base_url = 'https://open-api.123pan.com'
         self.config = self.load_config()
+        self.session = create_session()
 
     def load_config(self) -> dict:
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            raise Exception(f"读取配置文件失败: {str(e)}")
+        return read_config_file(self.config_path)
 
     def save_config(self):
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        write_config_file(self.config_path, self.config)
 
     def get_access_token(self) -> str:
         url = f"{self.base_url}/api/v1/access_token"
@@ -39,8 +103,8 @@ class TokenManager:
             "clientSecret": self.config['client_secret']
         }
 
-        response = requests.post(url, headers=headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
 
         if data['code'] == 0:
             self.config['access_token'] = data['data']['accessToken']
@@ -62,19 +126,36 @@ class Pan123FileManager:
             'Authorization': f"Bearer {self.config['access_token']}",
             'Content-Type': 'application/json'
         }
+        self.upload_concurrency = positive_int_setting(self.config, 'upload_concurrency', 8)
+        self.download_concurrency = positive_int_setting(self.config, 'download_concurrency', 8)
+        self.hash_workers = positive_int_setting(self.config, 'hash_workers', os.cpu_count() or 1)
+        # 连接池需容纳所有并发上传/下载线程，否则多出的连接会被丢弃
+        self.session = create_session(pool_size=max(self.upload_concurrency, self.download_concurrency))
+        self._upload_url_request = None
 
     def load_config(self) -> dict:
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            raise Exception(f"读取配置文件失败: {str(e)}")
+        return read_config_file(self.config_path)
 
     def save_config(self):
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        write_config_file(self.config_path, self.config)
+
+    def update_config(self, **changes):
+        """只修改内存中的配置，由flush_config统一写入文件"""
+        self.config.update(changes)
+        _dirty_configs.add(self.config_path)
 
-    def list_files(self, parent_id: int = 0, limit: int = 100, search_data: str = None, search_mode: int = 0) -> List[Dict]:
+    def flush_config(self):
+        """将尚未保存的配置修改写入文件"""
+        if self.config_path in _dirty_configs:
+            self.save_config()
+
+    def _update_auth(self, access_token: str):
+        """刷新token后只更新认证头，保留已建立的连接"""
+        self.headers['Authorization'] = f"Bearer {access_token}"
+        # 预构造的请求中带有旧token，需重新构造
+        self._upload_url_request = None
+
+    def list_files(self, parent_id: int = 0, limit: int = LIST_PAGE_LIMIT, search_data: str = None, search_mode: int = 0) -> List[Dict]:
         url = f"{self.base_url}/api/v2/file/list"
         params = {
             'parentFileId': parent_id,
@@ -86,8 +167,8 @@ class Pan123FileManager:
 
         files = []
         while True:
-            response = requests.get(url, headers=self.headers, params=params)
-            data = response.json()
+            response = self.session.get(url, headers=self.headers, params=params)
+            data = orjson.loads(response.content)
 
             if data['code'] != 0:
                 raise Exception(f"获取文件列表失败: {data['message']}")
@@ -100,18 +181,21 @@ class Pan123FileManager:
 
         return files
 
-    def calculate_file_md5(self, file_path: str) -> str:
-        """计算文件MD5"""
-        md5_hash = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
-
     def calculate_chunk_md5(self, chunk: bytes) -> str:
         """计算分片MD5"""
         return hashlib.md5(chunk).hexdigest()
 
+    def advise_sequential(self, fd: int):
+        """提示内核将顺序读取该文件，以扩大预读窗口（无posix_fadvise的平台直接跳过）"""
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def map_file(self, f):
+        """以只读方式将文件映射到内存（空文件无法mmap，直接使用空bytes）"""
+        if os.fstat(f.fileno()).st_size == 0:
+            return contextlib.nullcontext(b'')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     def create_directory(self, name: str, parent_id: int = 0) -> int:
         """创建目录"""
         url = f"{self.base_url}/upload/v1/file/mkdir"
@@ -120,18 +204,15 @@ class Pan123FileManager:
             "parentID": parent_id
         }
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['dirID']
         raise Exception(f"创建目录失败: {data['message']}")
 
-    def create_file(self, filename: str, file_path: str, parent_id: int = 0) -> Tuple[str, int, bool, int]:
+    def create_file(self, filename: str, file_size: int, file_md5: str, parent_id: int = 0) -> Tuple[str, int, bool, int]:
         """创建文件，返回预上传ID、文件ID、是否秒传、分片大小"""
-        file_size = os.path.getsize(file_path)
-        file_md5 = self.calculate_file_md5(file_path)
-        
         url = f"{self.base_url}/upload/v1/file/create"
         payload = {
             "parentFileID": parent_id,
@@ -140,8 +221,8 @@ class Pan123FileManager:
             "size": file_size
         }
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return (
@@ -154,14 +235,23 @@ class Pan123FileManager:
 
     def get_upload_url(self, preupload_id: str, slice_no: int) -> str:
         """获取上传地址"""
-        url = f"{self.base_url}/upload/v1/file/get_upload_url"
         payload = {
             "preuploadID": preupload_id,
             "sliceNo": slice_no
         }
-        
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+
+        # 每个分片都会调用，复用预先构造好的请求，只需填充请求体
+        if self._upload_url_request is None:
+            url = f"{self.base_url}/upload/v1/file/get_upload_url"
+            prepared = self.session.prepare_request(requests.Request('POST', url, headers=self.headers))
+            settings = self.session.merge_environment_settings(url, {}, None, None, None)
+            self._upload_url_request = (prepared, settings)
+        prepared, settings = self._upload_url_request
+        request = prepared.copy()
+        request.prepare_body(data=orjson.dumps(payload), files=None)
+
+        response = self.session.send(request, **settings)
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['presignedURL']
@@ -172,8 +262,8 @@ class Pan123FileManager:
         url = f"{self.base_url}/upload/v1/file/list_upload_parts"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['parts']
@@ -184,8 +274,8 @@ class Pan123FileManager:
         url = f"{self.base_url}/upload/v1/file/upload_complete"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return (
@@ -200,13 +290,97 @@ class Pan123FileManager:
         url = f"{self.base_url}/upload/v1/file/upload_async_result"
         payload = {"preuploadID": preupload_id}
         
-        response = requests.post(url, headers=self.headers, json=payload)
-        data = response.json()
+        response = self.session.post(url, headers=self.headers, data=orjson.dumps(payload))
+        data = orjson.loads(response.content)
         
         if data['code'] == 0:
             return data['data']['completed'], data['data']['fileID']
         raise Exception(f"检查异步结果失败: {data['message']}")
 
+    def upload_chunk(self, preupload_id: str, slice_no: int, chunk: memoryview, url_future: Future, etag_future: Future) -> Dict:
+        """上传单个分片（内存映射的零拷贝视图，上传后立即释放），返回分片号及其MD5"""
+        with chunk:
+            # 上传地址已提前请求，通常此时已经就绪
+            upload_url = url_future.result()
+
+            # 上传分片
+            headers = {'Content-Type': 'application/octet-stream'}
+            response = self.session.put(upload_url, headers=headers, data=chunk)
+
+            if response.status_code != 200:
+                raise Exception(f"分片 {slice_no} 上传失败: {response.text}")
+
+            # 对象存储返回的ETag通常即分片内容的MD5，可直接在本地校验；
+            # 不是MD5格式的ETag（如加密存储或厂商自定义格式）则留给list_uploaded_parts校验
+            etag = etag_future.result()
+            server_etag = response.headers.get('ETag', '').strip('"').lower()
+            verified = MD5_HEX_PATTERN.fullmatch(server_etag) is not None
+            if verified and server_etag != etag:
+                raise Exception(f"分片 {slice_no} 验证失败")
+
+            return {
+                'partNumber': slice_no,
+                'etag': etag,
+                'verified': verified
+            }
+
+    def upload_slices(self, preupload_id: str, buf, slice_size: int) -> List[Dict]:
+        """从内存映射中切分并并发上传所有分片，返回各分片的分片号、MD5及是否已在本地校验"""
+        total_chunks = math.ceil(len(buf) / slice_size)
+        concurrency = self.upload_concurrency
+        uploaded_chunks = []
+
+        # 读取、哈希、上传三个阶段流水线并行：主线程按顺序切分分片，
+        # 哈希线程池计算分片MD5（hashlib计算时释放GIL，可占用多个CPU核心），
+        # 上传线程池PUT分片，各阶段互相掩盖耗时。
+        # 上传地址在分片进入流水线时即开始请求，等轮到上传时往返已经完成
+        with memoryview(buf) as view, \
+                ThreadPoolExecutor(max_workers=self.hash_workers) as hasher, \
+                ThreadPoolExecutor(max_workers=concurrency) as url_fetcher, \
+                ThreadPoolExecutor(max_workers=concurrency) as uploader:
+            # 循环中频繁使用的方法预先绑定为局部变量
+            get_upload_url = self.get_upload_url
+            calculate_chunk_md5 = self.calculate_chunk_md5
+            upload_chunk = self.upload_chunk
+            submit_url, submit_hash, submit_upload = url_fetcher.submit, hasher.submit, uploader.submit
+
+            # 分片完成后统一在主线程记录结果并输出进度，避免多个上传线程同时打印
+            def collect(done):
+                for future in done:
+                    part = future.result()
+                    uploaded_chunks.append(part)
+                    print(f"已上传分片 {part['partNumber']}/{total_chunks}")
+
+            pending = set()
+            try:
+                for chunk_index in range(total_chunks):
+                    offset = chunk_index * slice_size
+                    slice_no = chunk_index + 1
+
+                    # 直接传递内存映射的切片视图，避免为每个分片复制一份bytes
+                    url_future = submit_url(get_upload_url, preupload_id, slice_no)
+                    etag_future = submit_hash(calculate_chunk_md5, view[offset:offset + slice_size])
+                    pending.add(submit_upload(
+                        upload_chunk, preupload_id, slice_no,
+                        view[offset:offset + slice_size], url_future, etag_future
+                    ))
+
+                    # 限制流水线中同时驻留内存的分片数量
+                    if len(pending) >= concurrency * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            except Exception:
+                # 任一分片失败则取消尚未开始的分片
+                for future in pending:
+                    future.cancel()
+                raise
+
+        return uploaded_chunks
+
     def upload_file(self, file_path: str, parent_id: int = 0) -> int:
         """上传文件的主函数"""
         original_filename = os.path.basename(file_path)
@@ -221,60 +395,45 @@ class Pan123FileManager:
                 print("上传已取消。")
                 sys.exit(0)
             else:
-                # 创建一个新的文件名
+                # 创建一个新的文件名（一次搜索取回所有已有副本名，在本地找出可用的编号）
                 name, ext = os.path.splitext(filename)
+                taken = self.search_filenames(f"{name}_copy", parent_id) | {original_filename}
                 counter = 1
-                while self.check_file_exists(filename, parent_id):
+                while filename in taken:
                     filename = f"{name}_copy{counter}{ext}"
                     counter += 1
                 print(f"文件将以新名称上传: {filename}")
 
-        # 1. 创建文件
-        preupload_id, file_id, is_reuse, slice_size = self.create_file(filename, file_path, parent_id)
-        
-        if is_reuse:
-            print("文件秒传成功！")
-            return file_id
+        with open(file_path, 'rb', buffering=0) as f, self.map_file(f) as buf:
+            file_size = len(buf)
+            self.advise_sequential(f.fileno())
 
-        print(f"文件需要分片上传，分片大小: {slice_size} bytes")
-        
-        # 2. 分片上传
-        file_size = os.path.getsize(file_path)
-        total_chunks = math.ceil(file_size / slice_size)
-        uploaded_chunks = []
+            # 1. 创建文件（MD5与分片上传共用同一份内存映射）
+            # 文件能放进页缓存时，分片上传直接命中缓存，磁盘只读一次；
+            # 文件大于可用内存时，计算MD5读过的页会被回收，上传分片时仍需再从磁盘读一遍
+            file_md5 = hashlib.md5(buf).hexdigest()
+            preupload_id, file_id, is_reuse, slice_size = self.create_file(filename, file_size, file_md5, parent_id)
 
-        with open(file_path, 'rb') as f:
-            for chunk_index in range(total_chunks):
-                chunk = f.read(slice_size)
-                slice_no = chunk_index + 1
-                
-                # 获取上传URL
-                upload_url = self.get_upload_url(preupload_id, slice_no)
-                
-                # 上传分片
-                print(f"上传分片 {slice_no}/{total_chunks}")
-                headers = {'Content-Type': 'application/octet-stream'}
-                response = requests.put(upload_url, headers=headers, data=chunk)
-                
-                if response.status_code != 200:
-                    raise Exception(f"分片 {slice_no} 上传失败: {response.text}")
-                
-                uploaded_chunks.append({
-                    'partNumber': slice_no,
-                    'etag': self.calculate_chunk_md5(chunk)
-                })
+            if is_reuse:
+                print("文件秒传成功！")
+                return file_id
+
+            print(f"文件需要分片上传，分片大小: {slice_size} bytes")
+
+            # 2. 分片上传（多个分片并发上传）
+            uploaded_chunks = self.upload_slices(preupload_id, buf, slice_size)
 
         # 3. 验证分片（如果文件大于分片大小）
-        if file_size > slice_size:
+        # 上传时已用响应ETag校验过的分片无需再向服务端列举，除非配置了strict_verify
+        verified_locally = all(part['verified'] for part in uploaded_chunks)
+        if file_size > slice_size and (self.config.get('strict_verify') or not verified_locally):
             print("验证已上传分片...")
             server_parts = self.list_uploaded_parts(preupload_id)
+            server_parts_by_number = {p['partNumber']: p for p in server_parts}
             
             # 验证每个分片
             for local_part in uploaded_chunks:
-                server_part = next(
-                    (p for p in server_parts if p['partNumber'] == local_part['partNumber']),
-                    None
-                )
+                server_part = server_parts_by_number.get(local_part['partNumber'])
                 if not server_part or server_part['etag'] != local_part['etag']:
                     raise Exception(f"分片 {local_part['partNumber']} 验证失败")
 
@@ -285,52 +444,35 @@ class Pan123FileManager:
         # 5. 如果需要，等待异步结果
         if is_async:
             print("等待服务器处理...")
+            # 指数退避轮询（带少量随机抖动），上限30秒
+            delay = 0.5
             while True:
                 completed, final_file_id = self.check_async_result(preupload_id)
                 if completed:
                     file_id = final_file_id
                     break
-                time.sleep(1)
+                time.sleep(delay + random.uniform(0, delay * 0.1))
+                delay = min(delay * 1.7, 30.0)
 
         print(f"文件上传成功！文件ID: {file_id}")
         return file_id
 
     def list_folders(self, parent_id: int = 0) -> List[Dict]:
         """获取指定目录下的所有文件夹"""
-        url = f"{self.base_url}/api/v2/file/list"
-        params = {
-            'parentFileId': parent_id,
-            'limit': 100,  # 假设每页最多100个项目
-        }
-        folders = []
-
-        while True:
-            response = requests.get(url, headers=self.headers, params=params)
-            data = response.json()
-
-            if data['code'] != 0:
-                raise Exception(f"获取文件夹列表失败: {data['message']}")
-
-            folders.extend([f for f in data['data']['fileList'] if f['type'] == 1])  # type 1 表示文件夹
-
-            if data['data']['lastFileId'] == -1:  # -1 表示没有更多页面
-                break
-            params['lastFileId'] = data['data']['lastFileId']
-
-        return folders
+        return [f for f in self.list_files(parent_id) if f['type'] == 1]  # type 1 表示文件夹
 
     def check_file_exists(self, filename: str, parent_id: int) -> Optional[Dict]:
         """检查指定目录下是否存在同名文件"""
         url = f"{self.base_url}/api/v2/file/list"
         params = {
             'parentFileId': parent_id,
-            'limit': 100,
+            'limit': LIST_PAGE_LIMIT,
             'searchData': filename,
             'searchMode': 1  # 精确搜索
         }
 
-        response = requests.get(url, headers=self.headers, params=params)
-        data = response.json()
+        response = self.session.get(url, headers=self.headers, params=params)
+        data = orjson.loads(response.content)
 
         if data['code'] != 0:
             raise Exception(f"检查文件是否存在失败: {data['message']}")
@@ -341,12 +483,18 @@ class Pan123FileManager:
 
         return None
 
+    def search_filenames(self, search_data: str, parent_id: int) -> set:
+        """模糊搜索指定目录下的文件名"""
+        # 搜索为全局查找，需按父目录过滤
+        files = self.list_files(parent_id, search_data=search_data, search_mode=0)
+        return {f['filename'] for f in files if f.get('parentFileId', parent_id) == parent_id}
+
     def get_download_url(self, file_id: int) -> str:
         """获取文件的下载链接"""
         url = f"{self.base_url}/api/v2/file/download_address"
         params = {'fileID': file_id}
-        response = requests.get(url, headers=self.headers, params=params)
-        data = response.json()
+        response = self.session.get(url, headers=self.headers, params=params)
+        data = orjson.loads(response.content)
 
         if data['code'] != 0:
             raise Exception(f"获取下载链接失败: {data['message']}")
@@ -354,7 +502,7 @@ class Pan123FileManager:
         return data['data']['downloadAddress']
 
     def download_file(self, download_url: str, save_path: str):
-        """使用wget下载文件"""
+        """下载文件"""
         # 解析URL中的文件名
         parsed_url = urllib.parse.urlparse(download_url)
         query_params = urllib.parse.parse_qs(parsed_url.query)
@@ -372,14 +520,112 @@ class Pan123FileManager:
 
         full_save_path = os.path.join(save_path, filename)
 
-        # 使用wget下载文件
-        wget_command = ['wget', '-O', full_save_path, download_url]
         try:
-            subprocess.run(wget_command, check=True)
+            self.fetch_file(download_url, full_save_path)
             print(f"文件已成功下载到: {full_save_path}")
-        except subprocess.CalledProcessError as e:
+        except (requests.RequestException, OSError) as e:
             print(f"下载失败: {e}")
 
+    def fetch_file(self, download_url: str, full_save_path: str):
+        """下载文件到指定路径，失败时删除不完整的文件"""
+        with open(full_save_path, 'wb', buffering=0) as out:
+            try:
+                self.write_download(download_url, out)
+            except BaseException:
+                out.close()
+                os.remove(full_save_path)
+                raise
+
+            # 已下载的数据无需常驻页缓存。内核只会丢弃已落盘的干净页，
+            # 因此先等待数据写入磁盘再提示，下载会在数据落盘后才返回
+            if hasattr(os, 'posix_fadvise'):
+                os.fdatasync(out.fileno())
+                os.posix_fadvise(out.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def write_download(self, download_url: str, out):
+        """服务端支持Range且文件足够大时分段并发下载，否则单连接流式下载"""
+        # 请求从0开始到结尾的Range，既能从Content-Range得知文件大小，小文件又可直接沿用这个响应
+        with self.session.get(download_url, headers={'Range': 'bytes=0-'}, stream=True) as response:
+            if response.status_code == 416:
+                if response.headers.get('Content-Range') == 'bytes */0':
+                    # 空文件无法满足任何Range，输出文件保持为空即可
+                    return
+                # 其他无法满足Range的情况改为不带Range重新下载
+                self.fetch_whole(download_url, out)
+                return
+            response.raise_for_status()
+
+            file_size = 0
+            if response.status_code == 206:
+                span, _, total = response.headers.get('Content-Range', '').rpartition('/')
+                if not (total.isdigit() and span.endswith(f"-{int(total) - 1}")):
+                    # 服务端只返回了文件的一部分，无法沿用这个响应
+                    self.fetch_whole(download_url, out)
+                    return
+                file_size = int(total)
+
+            if not hasattr(os, 'pwrite') or file_size < PARALLEL_DOWNLOAD_THRESHOLD:
+                # 服务端忽略Range返回完整文件，或文件较小，直接用这个响应下载
+                self.write_stream(response, out)
+                return
+            # 重定向后的最终地址，分段请求直接访问
+            url = response.url
+
+        try:
+            self.fetch_ranges(url, out.fileno(), file_size)
+        except requests.HTTPError as e:
+            # 分段请求未按Range返回，改为单连接重新下载
+            if e.response is None or e.response.status_code != 200:
+                raise
+            out.seek(0)
+            out.truncate()
+            self.fetch_whole(download_url, out)
+
+    def fetch_whole(self, download_url: str, out):
+        """不带Range单连接下载整个文件"""
+        with self.session.get(download_url, stream=True) as response:
+            response.raise_for_status()
+            self.write_stream(response, out)
+
+    def write_stream(self, response: requests.Response, out):
+        """将响应内容按块写入文件"""
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            out.write(chunk)
+
+    def fetch_ranges(self, url: str, fd: int, file_size: int):
+        """将文件切成若干段并发下载，各段直接写入文件中对应的偏移位置"""
+        concurrency = self.download_concurrency
+        part_size = math.ceil(file_size / concurrency)
+        os.ftruncate(fd, file_size)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(self.fetch_range, url, fd, start, min(start + part_size, file_size) - 1)
+                for start in range(0, file_size, part_size)
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def fetch_range(self, url: str, fd: int, start: int, end: int):
+        """下载[start, end]字节区间并写入文件"""
+        headers = {'Range': f"bytes={start}-{end}"}
+        with self.session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.HTTPError(f"分段下载失败({start}-{end}): HTTP {response.status_code}", response=response)
+
+            offset = start
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                written = 0
+                while written < len(chunk):
+                    written += os.pwrite(fd, chunk[written:], offset + written)
+                offset += len(chunk)
+
 def select_file_or_folder(file_manager: Pan123FileManager, parent_id: int = 0) -> Tuple[int, bool]:
     while True:
         print(f"\n当前文件夹ID: {parent_id}")
@@ -413,83 +659,86 @@ def main():
     token_manager = TokenManager(config_path)
     file_manager = Pan123FileManager(config_path)
 
-    while True:
-        action = input("请选择操作：\n1. 获取access token\n2. 下载文件\n3. 上传文件\n4. 退出\n请输入选项(1/2/3/4): ").strip()
+    try:
+        while True:
+            action = input("请选择操作：\n1. 获取access token\n2. 下载文件\n3. 上传文件\n4. 退出\n请输入选项(1/2/3/4): ").strip()
         
-        if action == '1':
-            try:
-                token_manager.get_access_token()
-                file_manager = Pan123FileManager(config_path)  # 刷新file_manager以使用新的token
-            except Exception as e:
-                print(f"获取access token失败: {str(e)}")
+            if action == '1':
+                try:
+                    access_token = token_manager.get_access_token()
+                    # 两者共享同一份配置，只需更新file_manager的认证头
+                    file_manager._update_auth(access_token)
+                except Exception as e:
+                    print(f"获取access token失败: {str(e)}")
         
-        elif action == '2':
-            try:
-                use_config = input("是否使用config.json中的下载设置？(y/n): ").strip().lower()
-                if use_config == 'y':
-                    download_url = file_manager.config.get('download_url')
-                    save_path = file_manager.config.get('download_path')
-                    if not download_url or not save_path:
-                        raise ValueError("配置文件中缺少下载URL或保存路径")
-                else:
-                    print("请选择要下载的文件：")
-                    file_id, is_folder = select_file_or_folder(file_manager)
-                    if is_folder:
-                        print("您选择了一个文件夹，请选择一个文件进行下载。")
-                        continue
-                    download_url = file_manager.get_download_url(file_id)
-                    save_path = input("请输入保存路径: ").strip()
-
-                file_manager.download_file(download_url, save_path)
-            except Exception as e:
-                print(f"下载文件失败: {str(e)}")
+            elif action == '2':
+                try:
+                    use_config = input("是否使用config.json中的下载设置？(y/n): ").strip().lower()
+                    if use_config == 'y':
+                        download_url = file_manager.config.get('download_url')
+                        save_path = file_manager.config.get('download_path')
+                        if not download_url or not save_path:
+                            raise ValueError("配置文件中缺少下载URL或保存路径")
+                    else:
+                        print("请选择要下载的文件：")
+                        file_id, is_folder = select_file_or_folder(file_manager)
+                        if is_folder:
+                            print("您选择了一个文件夹，请选择一个文件进行下载。")
+                            continue
+                        download_url = file_manager.get_download_url(file_id)
+                        save_path = input("请输入保存路径: ").strip()
+
+                    file_manager.download_file(download_url, save_path)
+                except Exception as e:
+                    print(f"下载文件失败: {str(e)}")
         
-        elif action == '3':
-            while True:
-                use_config = input("是否使用配置文件中的上传文件和目标网盘ID? (y/n): ").lower().strip()
+            elif action == '3':
+                while True:
+                    use_config = input("是否使用配置文件中的上传文件和目标网盘ID? (y/n): ").lower().strip()
                 
-                if use_config == 'y':
-                    file_path = file_manager.config.get('upload_file_path')
-                    parent_id = file_manager.config.get('parent_folder_id', 0)
+                    if use_config == 'y':
+                        file_path = file_manager.config.get('upload_file_path')
+                        parent_id = file_manager.config.get('parent_folder_id', 0)
                     
-                    if not file_path:
-                        print("错误：配置文件中未指定上传文件路径")
-                        continue
+                        if not file_path:
+                            print("错误：配置文件中未指定上传文件路径")
+                            continue
                     
-                    try:
-                        file_id = file_manager.upload_file(file_path, parent_id)
-                        print(f"文件上传完成，文件ID: {file_id}")
-                    except Exception as e:
-                        print(f"上传失败: {str(e)}")
+                        try:
+                            file_id = file_manager.upload_file(file_path, parent_id)
+                            print(f"文件上传完成，文件ID: {file_id}")
+                        except Exception as e:
+                            print(f"上传失败: {str(e)}")
                     
-                    break
-                elif use_config == 'n':
-                    print("选择目标文件夹：")
-                    new_parent_id = select_file_or_folder(file_manager)[0]
-                    file_manager.config['parent_folder_id'] = new_parent_id
-                    file_manager.save_config()
-                    print(f"已更新配置文件中的目标文件夹ID: {new_parent_id}")
+                        break
+                    elif use_config == 'n':
+                        print("选择目标文件夹：")
+                        new_parent_id = select_file_or_folder(file_manager)[0]
+                        file_manager.update_config(parent_folder_id=new_parent_id)
+                        print(f"已更新配置中的目标文件夹ID: {new_parent_id}（退出时写入配置文件）")
                     
-                    file_path = input("请输入要上传的文件路径: ").strip()
-                    file_manager.config['upload_file_path'] = file_path
-                    file_manager.save_config()
+                        file_path = input("请输入要上传的文件路径: ").strip()
+                        file_manager.update_config(upload_file_path=file_path)
                     
-                    try:
-                        file_id = file_manager.upload_file(file_path, new_parent_id)
-                        print(f"文件上传完成，文件ID: {file_id}")
-                    except Exception as e:
-                        print(f"上传失败: {str(e)}")
+                        try:
+                            file_id = file_manager.upload_file(file_path, new_parent_id)
+                            print(f"文件上传完成，文件ID: {file_id}")
+                        except Exception as e:
+                            print(f"上传失败: {str(e)}")
                     
-                    break
-                else:
-                    print("无效的输入，请输入 y 或 n")
+                        break
+                    else:
+                        print("无效的输入，请输入 y 或 n")
         
-        elif action == '4':
-            print("程序退出")
-            break
+            elif action == '4':
+                print("程序退出")
+                break
         
-        else:
-            print("无效的选择，请重新输入。")
+            else:
+                print("无效的选择，请重新输入。")
+    finally:
+        # 退出时统一保存本次会话中修改的配置
+        file_manager.flush_config()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file